@@ -1,109 +1,339 @@
-# app.py - Main Flask application configuration and routes
+# app.py - Main FastAPI application configuration and routes
 import os
+import asyncio
 import logging
-from flask import Flask, request, jsonify, render_template
-from flask_cors import CORS
-from caption_service import extract_captions, format_captions, validate_youtube_url
-from werkzeug.middleware.proxy_fix import ProxyFix
+import anyio
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response
+from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from slowapi.errors import RateLimitExceeded
+from slowapi.middleware import SlowAPIMiddleware
+from caption_service import UpstreamUnavailable, extract_captions, format_captions, parse_youtube_url
+from caption_cache import create_client, get_cached_captions, get_stale_captions, rotate_popularity, set_cached_captions
+from rate_limit import VIDEO_RATE_LIMIT, VIDEO_RATE_LIMIT_SCOPE, hit_video_limit, limiter, video_rate_limit
 
-print('running...')
+# Debug mode and auto-reload are only enabled for local development
+DEBUG = os.environ.get('APP_ENV') == 'development'
 
-# Create and configure the Flask application
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
+class ORJSONResponse(JSONResponse):
+    """JSON response serialized with orjson, which is much faster than the
+    stdlib encoder on large caption payloads."""
+
+    def render(self, content):
+        return orjson.dumps(content)
+
+# Upper bound on the number of URLs accepted by the batch endpoint. Each URL
+# counts against the client's video rate limit, so a larger batch could never
+# be served.
+MAX_BATCH_SIZE = 10
+
+def _error_body(error, message):
+    """Serialize an error response body."""
+    return orjson.dumps({'error': error, 'message': message})
+
+def _server_error(e):
+    """Build the error body reported when processing captions fails."""
+    return {'error': 'Server error', 'message': f'An error occurred while processing the captions: {str(e)}'}
+
+# Errors reported both as responses and per URL in batch results
+_INVALID_URL = {'error': 'Invalid YouTube URL', 'message': 'The provided URL does not appear to be a valid YouTube video URL'}
+_NO_CAPTIONS = {'error': 'Captions unavailable', 'message': 'No captions/subtitles available for this video or they are disabled'}
+_UPSTREAM_UNAVAILABLE = {'error': 'Service unavailable', 'message': 'YouTube is currently unavailable, please try again later'}
+
+# Bodies of the fixed error responses are serialized once at import, since
+# these paths are hit constantly (e.g. 404s from bots probing for URLs)
+_ERR_MISSING_URL = (_error_body('Missing YouTube URL', 'Please provide a valid YouTube URL in the request body'), 400)
+_ERR_INVALID_URL = (orjson.dumps(_INVALID_URL), 400)
+_ERR_NO_CAPTIONS = (orjson.dumps(_NO_CAPTIONS), 404)
+_ERR_MISSING_URLS = (_error_body('Missing YouTube URLs', 'Please provide a list of YouTube URLs in the request body'), 400)
+_ERR_TOO_MANY_URLS = (_error_body('Too many URLs', f'A batch may contain at most {MAX_BATCH_SIZE} URLs'), 400)
+_ERR_NOT_FOUND = (_error_body('Not found', 'The requested resource was not found on this server'), 404)
+_ERR_METHOD_NOT_ALLOWED = (_error_body('Method not allowed', 'The method is not allowed for the requested URL'), 405)
+_ERR_SERVER = (_error_body('Server error', 'An internal server error occurred'), 500)
+_ERR_UPSTREAM_UNAVAILABLE = (orjson.dumps(_UPSTREAM_UNAVAILABLE), 503)
+_ERR_TOO_MANY_VIDEOS = (_error_body('Too many requests', f'Rate limit exceeded: {video_rate_limit}'), 429)
+
+def error_response(error):
+    """
+    Build a JSON error response from a precomputed (body, status) pair.
+
+    Args:
+        error (tuple): The serialized body and HTTP status code
+
+    Returns:
+        Response: The error response
+    """
+    body, status_code = error
+    return Response(body, status_code=status_code, media_type='application/json')
+
+# Worker threads used to fetch batch transcripts from YouTube concurrently
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='caption-batch')
+
+# Threads available to the default threadpool. Every caption request sleeps on
+# YouTube I/O in one of these, so Starlette's default of 40 caps concurrency.
+THREADPOOL_SIZE = int(os.environ.get('THREADPOOL_SIZE', '300'))
+
+# Upper bound on concurrent YouTube fetches per process, independent of how
+# many client requests are in flight; matches the HTTP connection pool size
+_youtube_slots = asyncio.Semaphore(int(os.environ.get('YOUTUBE_CONCURRENCY', '64')))
+
+@asynccontextmanager
+async def lifespan(app):
+    """Open shared clients on startup and close them on shutdown."""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    app.state.redis = create_client()
+    rotation = asyncio.create_task(rotate_popularity())
+    yield
+    rotation.cancel()
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
+
+# Create and configure the FastAPI application. The built-in Swagger/ReDoc
+# pages are disabled because /docs serves our own documentation template.
+app = FastAPI(lifespan=lifespan, debug=DEBUG, default_response_class=ORJSONResponse, docs_url=None, redoc_url=None)
+templates = Jinja2Templates(directory="templates")
+
+# Compress larger responses; caption text is highly redundant prose. The
+# reverse proxy should not compress these responses again.
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Apply per-client rate limits to every route
+app.state.limiter = limiter
+app.add_middleware(SlowAPIMiddleware)
 
 # Enable CORS for all routes to allow frontend integration
-CORS(app)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-@app.route('/')
-def index():
+async def fetch_raw_captions(url, video_id, executor=None):
+    """
+    Fetch the raw caption segments for a YouTube URL without blocking the loop.
+
+    Args:
+        url (str): The YouTube video URL
+        video_id (str): The video ID parsed from the URL
+        executor (Executor): Executor to fetch on, or None for the default threadpool
+
+    Returns:
+        list: A list of caption segments or None if not available
+    """
+    # youtube_transcript_api is sync-only, so the blocking fetch runs in a
+    # worker thread to keep the event loop free for other requests
+    async with _youtube_slots:
+        if executor is None:
+            return await run_in_threadpool(extract_captions, url, video_id)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, extract_captions, url, video_id)
+
+async def load_captions(redis_client, url, video_id, executor=None):
+    """
+    Get the formatted captions for a validated YouTube URL.
+
+    Args:
+        redis_client (redis.Redis): The caption cache client, or None
+        url (str): The YouTube video URL
+        video_id (str): The video ID parsed from the URL
+        executor (Executor): Executor to fetch on, or None for the default threadpool
+
+    Returns:
+        tuple: (captions, stale) where captions is the formatted text or None
+            if not available, and stale is True if it was served from the
+            stale cache because YouTube is unavailable
+
+    Raises:
+        UpstreamUnavailable: If YouTube is unavailable and nothing is cached
+    """
+    # Serve from the cache when this video has been seen before
+    hit, formatted_text = await get_cached_captions(redis_client, video_id)
+    if hit:
+        return formatted_text, False
+
+    try:
+        raw_captions = await fetch_raw_captions(url, video_id, executor)
+    except UpstreamUnavailable:
+        # Fall back to the last known captions while YouTube is failing
+        formatted_text = await get_stale_captions(redis_client, video_id)
+        if formatted_text is None:
+            raise
+        return formatted_text, True
+
+    # Format the extracted captions for readability. Long transcripts take
+    # tens of milliseconds to format, so this stays off the event loop too.
+    formatted_text = await run_in_threadpool(format_captions, raw_captions) if raw_captions else None
+    await set_cached_captions(redis_client, video_id, formatted_text)
+
+    return formatted_text, False
+
+@app.get('/')
+async def index(request: Request):
     """Render the main application page."""
-    return render_template('index.html')
+    return templates.TemplateResponse(request, 'index.html')
 
-@app.route('/docs')
-def documentation():
+@app.get('/docs')
+async def documentation(request: Request):
     """Render the API documentation page."""
-    return render_template('documentation.html')
+    return templates.TemplateResponse(request, 'documentation.html')
 
-@app.route('/api/extract-captions', methods=['POST'])
-def get_captions():
+@app.post('/api/extract-captions')
+@limiter.shared_limit(VIDEO_RATE_LIMIT, scope=VIDEO_RATE_LIMIT_SCOPE)
+async def get_captions(request: Request):
     """
     API endpoint to extract and format YouTube video captions.
-    
+
     Expects a JSON payload with a 'url' field containing a valid YouTube URL.
     Returns formatted captions or appropriate error messages.
     """
     try:
-        data = request.get_json()
-        
-        if not data or 'url' not in data:
-            return jsonify({
-                'error': 'Missing YouTube URL',
-                'message': 'Please provide a valid YouTube URL in the request body'
-            }), 400
-        
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+
+        if not isinstance(data, dict) or 'url' not in data:
+            return error_response(_ERR_MISSING_URL)
+
         url = data['url']
-        logger.debug(f"Received request to extract captions for URL: {url}")
-        
-        # Validate the YouTube URL
-        if not validate_youtube_url(url):
-            return jsonify({
-                'error': 'Invalid YouTube URL',
-                'message': 'The provided URL does not appear to be a valid YouTube video URL'
-            }), 400
-        
-        # Extract captions from the YouTube video
-        raw_captions = extract_captions(url)
-        
-        if not raw_captions:
-            return jsonify({
-                'error': 'Captions unavailable',
-                'message': 'No captions/subtitles available for this video or they are disabled'
-            }), 404
-        
-        # Format the raw captions for readability
-        formatted_text = format_captions(raw_captions)
-        
-        # Return the formatted captions
-        return jsonify({
+        logger.debug("Received request to extract captions for URL: %s", url)
+
+        # Validate the YouTube URL and get its video ID
+        video_id = parse_youtube_url(url)
+        if not video_id:
+            return error_response(_ERR_INVALID_URL)
+
+        # Serve from the cache, or extract and format the captions
+        try:
+            formatted_text, stale = await load_captions(request.app.state.redis, url, video_id)
+        except UpstreamUnavailable:
+            return error_response(_ERR_UPSTREAM_UNAVAILABLE)
+
+        if not formatted_text:
+            return error_response(_ERR_NO_CAPTIONS)
+
+        # Return the formatted captions, flagging ones served from the stale
+        # cache while YouTube is unavailable
+        return ORJSONResponse({
             'success': True,
             'captions': formatted_text,
             'videoUrl': url,
             'length': len(formatted_text)
+        }, headers={'X-Cache': 'STALE'} if stale else None)
+
+    except Exception as e:
+        logger.error("Error processing caption request: %s", e, exc_info=True)
+        return ORJSONResponse(_server_error(e), status_code=500)
+
+@app.post('/api/extract-captions/batch')
+@limiter.limit("2/minute")
+async def get_captions_batch(request: Request):
+    """
+    API endpoint to extract and format captions for several YouTube videos.
+
+    Expects a JSON payload with a 'urls' field containing a list of YouTube
+    URLs. Transcripts are fetched concurrently and returned in request order,
+    each with either its formatted captions or an error message.
+    """
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+
+        if not isinstance(data, dict) or not isinstance(data.get('urls'), list) or not data['urls']:
+            return error_response(_ERR_MISSING_URLS)
+
+        urls = data['urls']
+        if len(urls) > MAX_BATCH_SIZE:
+            return error_response(_ERR_TOO_MANY_URLS)
+
+        logger.debug("Received batch request to extract captions for %s URLs", len(urls))
+
+        # Only valid URLs are fetched, and charged against the client's video
+        # rate limit; the rest are reported individually
+        video_ids = [parse_youtube_url(url) for url in urls]
+        if not hit_video_limit(request, sum(1 for video_id in video_ids if video_id)):
+            return error_response(_ERR_TOO_MANY_VIDEOS)
+
+        fetched = iter(await asyncio.gather(
+            *(load_captions(request.app.state.redis, url, video_id, _executor)
+              for url, video_id in zip(urls, video_ids) if video_id),
+            return_exceptions=True
+        ))
+
+        results = []
+        for url, video_id in zip(urls, video_ids):
+            if not video_id:
+                results.append({'videoUrl': url, **_INVALID_URL})
+                continue
+
+            outcome = next(fetched)
+            if isinstance(outcome, UpstreamUnavailable):
+                results.append({'videoUrl': url, **_UPSTREAM_UNAVAILABLE})
+                continue
+            if isinstance(outcome, Exception):
+                logger.error("Error processing caption request for %s: %s", url, outcome)
+                results.append({'videoUrl': url, **_server_error(outcome)})
+                continue
+
+            formatted_text, stale = outcome
+            if not formatted_text:
+                results.append({'videoUrl': url, **_NO_CAPTIONS})
+            else:
+                results.append({
+                    'videoUrl': url,
+                    'success': True,
+                    'captions': formatted_text,
+                    'length': len(formatted_text),
+                    'stale': stale
+                })
+
+        return ORJSONResponse({
+            'success': True,
+            'results': results
         })
-        
+
     except Exception as e:
-        logger.error(f"Error processing caption request: {str(e)}", exc_info=True)
-        return jsonify({
-            'error': 'Server error',
-            'message': f'An error occurred while processing the captions: {str(e)}'
-        }), 500
+        logger.error("Error processing batch caption request: %s", e, exc_info=True)
+        return ORJSONResponse(_server_error(e), status_code=500)
 
 # Error handlers for common HTTP errors
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({
-        'error': 'Not found',
-        'message': 'The requested resource was not found on this server'
-    }), 404
-
-@app.errorhandler(405)
-def method_not_allowed(error):
-    return jsonify({
-        'error': 'Method not allowed',
-        'message': 'The method is not allowed for the requested URL'
-    }), 405
-
-@app.errorhandler(500)
-def server_error(error):
-    return jsonify({
-        'error': 'Server error',
-        'message': 'An internal server error occurred'
-    }), 500
+@app.exception_handler(StarletteHTTPException)
+async def http_error(request: Request, exc: StarletteHTTPException):
+    if exc.status_code == 404:
+        return error_response(_ERR_NOT_FOUND)
+    if exc.status_code == 405:
+        return error_response(_ERR_METHOD_NOT_ALLOWED)
+    return ORJSONResponse({
+        'error': 'Error',
+        'message': exc.detail
+    }, status_code=exc.status_code, headers=exc.headers)
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limited(request: Request, exc: RateLimitExceeded):
+    return ORJSONResponse({
+        'error': 'Too many requests',
+        'message': f'Rate limit exceeded: {exc.detail}'
+    }, status_code=429)
+
+@app.exception_handler(Exception)
+async def server_error(request: Request, exc: Exception):
+    return error_response(_ERR_SERVER)
 
+# Local development server only; production runs under gunicorn (see procfile)
 if __name__ == '__main__':
-   app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
+    import uvicorn
+    uvicorn.run('main:app', host='0.0.0.0', port=8080, reload=DEBUG)
@@ -0,0 +1,187 @@
+# caption_cache.py - Redis-backed cache for formatted YouTube captions
+import os
+import asyncio
+import logging
+from collections import defaultdict, deque
+import redis.asyncio as redis
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Captions for a given video are effectively immutable, so they are kept for a
+# day, or for a month once the video is popular. The Redis instance is
+# expected to run with `maxmemory-policy allkeys-lfu` so rarely requested
+# videos are evicted first.
+CAPTION_TTL = 86400
+HOT_CAPTION_TTL = 86400 * 30
+
+# Captions stay in Redis for this long past their TTL so they can still be
+# served, marked as stale, while YouTube is unavailable
+STALE_TTL = 86400 * 7
+
+# A video requested more than HOT_THRESHOLD times within the last
+# POPULARITY_WINDOW minutes counts as popular
+POPULARITY_WINDOW = 5
+HOT_THRESHOLD = 15
+
+# Videos without captions are remembered briefly so repeated requests for them
+# don't hit YouTube every time, while still picking up captions added later.
+NEGATIVE_TTL = 3600
+
+# Value stored for videos that have no captions available
+_NO_CAPTIONS = ""
+
+class BucketTimeRateLimit:
+    """
+    Sliding-window request counter keyed by video ID.
+
+    Requests are counted in per-minute buckets; rotate() drops the oldest
+    bucket and starts a new one, so the sum over all buckets is the number of
+    requests seen within the window.
+    """
+
+    def __init__(self, buckets=POPULARITY_WINDOW, threshold=HOT_THRESHOLD):
+        self.buckets = deque(defaultdict(int) for _ in range(buckets))
+        self.threshold = threshold
+
+    def hit(self, video_id):
+        """Record a request for a video."""
+        self.buckets[-1][video_id] += 1
+
+    def count(self, video_id):
+        """Return the number of requests for a video within the window."""
+        return sum(bucket.get(video_id, 0) for bucket in self.buckets)
+
+    def is_hot(self, video_id):
+        """Return True if the video was requested often within the window."""
+        return self.count(video_id) > self.threshold
+
+    def rotate(self):
+        """Drop the oldest bucket and start counting in a new one."""
+        self.buckets.popleft()
+        self.buckets.append(defaultdict(int))
+
+# Popularity of videos requested from this process
+popularity = BucketTimeRateLimit()
+
+async def rotate_popularity():
+    """Rotate the popularity buckets every minute until cancelled."""
+    while True:
+        await asyncio.sleep(60)
+        popularity.rotate()
+
+def create_client():
+    """
+    Create the Redis client used for caching captions.
+
+    Returns:
+        redis.Redis: An asyncio Redis client, or None if REDIS_URL is not set
+    """
+    redis_url = os.environ.get("REDIS_URL")
+    if not redis_url:
+        logger.warning("REDIS_URL is not set, caption caching is disabled")
+        return None
+
+    return redis.from_url(redis_url, decode_responses=True)
+
+def cache_key(video_id):
+    """
+    Build the Redis key for a video's captions.
+
+    Args:
+        video_id (str): The YouTube video ID
+
+    Returns:
+        str: The cache key
+    """
+    return "cap:" + video_id
+
+async def get_cached_captions(client, video_id):
+    """
+    Look up the formatted captions for a video.
+
+    Args:
+        client (redis.Redis): The Redis client, or None if caching is disabled
+        video_id (str): The YouTube video ID
+
+    Returns:
+        tuple: (hit, captions) where captions is the formatted text, or None
+            if the video is cached as having no captions
+    """
+    if client is None or not video_id:
+        return False, None
+
+    popularity.hit(video_id)
+    key = cache_key(video_id)
+
+    try:
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.ttl(key)
+            cached, ttl = await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Caption cache lookup failed: %s", e)
+        return False, None
+
+    if cached is None:
+        return False, None
+
+    if cached == _NO_CAPTIONS:
+        return True, None
+
+    # Captions only kept around as a stale fallback count as a miss
+    if 0 <= ttl <= STALE_TTL:
+        return False, None
+
+    if ttl < HOT_CAPTION_TTL and popularity.is_hot(video_id):
+        # Keep popular videos cached for longer. The TTL is only extended when
+        # it has run below the hot TTL, so this costs a second round trip once
+        # per promotion rather than on every hit. Negative entries returned
+        # above keep their short TTL.
+        try:
+            await client.expire(key, HOT_CAPTION_TTL + STALE_TTL)
+        except redis.RedisError as e:
+            logger.warning("Caption cache update failed: %s", e)
+
+    return True, cached
+
+async def get_stale_captions(client, video_id):
+    """
+    Look up the last known captions for a video, even if past their TTL.
+
+    Args:
+        client (redis.Redis): The Redis client, or None if caching is disabled
+        video_id (str): The YouTube video ID
+
+    Returns:
+        str: The formatted captions or None if none are cached
+    """
+    if client is None or not video_id:
+        return None
+
+    try:
+        return await client.get(cache_key(video_id)) or None
+    except redis.RedisError as e:
+        logger.warning("Caption cache lookup failed: %s", e)
+        return None
+
+async def set_cached_captions(client, video_id, captions):
+    """
+    Store the formatted captions for a video.
+
+    Args:
+        client (redis.Redis): The Redis client, or None if caching is disabled
+        video_id (str): The YouTube video ID
+        captions (str): The formatted captions, or None if unavailable
+    """
+    if client is None or not video_id:
+        return
+
+    try:
+        if captions:
+            ttl = HOT_CAPTION_TTL if popularity.is_hot(video_id) else CAPTION_TTL
+            await client.set(cache_key(video_id), captions, ex=ttl + STALE_TTL)
+        else:
+            await client.set(cache_key(video_id), _NO_CAPTIONS, ex=NEGATIVE_TTL)
+    except redis.RedisError as e:
+        logger.warning("Caption cache update failed: %s", e)
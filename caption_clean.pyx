@@ -0,0 +1,79 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# caption_clean.pyx - Single-pass cleanup and paragraph grouping of caption text
+
+cdef inline bint _is_sentence_end(Py_UCS4 c):
+    return c == u'.' or c == u'!' or c == u'?'
+
+cpdef list clean_and_paragraphize(str raw, int sentences_per_para=5):
+    """
+    Clean joined caption text and split it into paragraphs in one pass.
+
+    Whitespace runs collapse to a single space, a period directly followed by
+    an uppercase letter gets a space inserted after it, and a new paragraph
+    starts after every `sentences_per_para` sentences. The output matches the
+    regex pipeline in caption_service.
+
+    Args:
+        raw (str): The caption segments joined with spaces
+        sentences_per_para (int): Number of sentences per paragraph
+
+    Returns:
+        list: The formatted paragraphs, without empty ones
+    """
+    cdef Py_ssize_t n = len(raw)
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t j
+    cdef Py_ssize_t start = 0
+    cdef Py_UCS4 c
+    cdef Py_UCS4 nxt
+    cdef Py_UCS4 prev = 0
+    cdef int sentences = 0
+    cdef bint boundary
+    cdef list parts = []
+    cdef list paragraphs = []
+
+    while i < n:
+        c = raw[i]
+
+        if c.isspace():
+            # Copy the untouched run before this whitespace, then skip the rest
+            # of the whitespace run
+            parts.append(raw[start:i])
+            j = i + 1
+            while j < n and raw[j].isspace():
+                j += 1
+            boundary = _is_sentence_end(prev)
+        elif c == u'.' and i + 1 < n:
+            nxt = raw[i + 1]
+            if not (u'A' <= nxt <= u'Z'):
+                prev = c
+                i += 1
+                continue
+            # A period glued to the next sentence gets a space after it
+            parts.append(raw[start:i + 1])
+            j = i + 1
+            boundary = True
+        else:
+            prev = c
+            i += 1
+            continue
+
+        if boundary:
+            sentences += 1
+            if sentences % sentences_per_para == 0:
+                paragraphs.append(u''.join(parts))
+                parts = []
+            else:
+                parts.append(u' ')
+        else:
+            parts.append(u' ')
+
+        prev = u' '
+        i = j
+        start = j
+
+    parts.append(raw[start:n])
+    paragraph = u''.join(parts)
+    if paragraph:
+        paragraphs.append(paragraph)
+    return paragraphs
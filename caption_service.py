@@ -1,158 +1,347 @@
 # caption_service.py - Service for YouTube caption extraction and processing
+import os
 import re
+import atexit
 import logging
+from operator import attrgetter, itemgetter
 from urllib.parse import urlparse, parse_qs
-from youtube_transcript_api import YouTubeTranscriptApi, NoTranscriptFound, TranscriptsDisabled, VideoUnavailable
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from youtube_transcript_api import (
+    YouTubeTranscriptApi, CouldNotRetrieveTranscript, NoTranscriptFound, RequestBlocked,
+    TranscriptsDisabled, VideoUnavailable, YouTubeRequestFailed
+)
+from rate_limit import CircuitBreaker, TokenBucket, per_process_budget
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# The compiled cleanup routine is used when the extension has been built
+# (python setup.py build_ext --inplace); otherwise the regex implementation
+# below is used
+try:
+    from caption_clean import clean_and_paragraphize
+except ImportError:
+    clean_and_paragraphize = None
+
+# Requests per minute we allow ourselves against YouTube across all workers.
+# Each extraction costs two requests (transcript list + transcript text).
+YOUTUBE_RPM = int(os.environ.get("YOUTUBE_RPM", "120"))
+_youtube_bucket = TokenBucket(per_process_budget(YOUTUBE_RPM))
+
+# Longest a request waits for budget before giving up, so a burst can't park
+# every worker thread on the bucket for minutes
+YOUTUBE_BUDGET_WAIT = float(os.environ.get("YOUTUBE_BUDGET_WAIT", "2"))
+
+# (connect, read) timeouts for YouTube requests, so a hung call can't pin a
+# worker thread indefinitely
+YOUTUBE_TIMEOUT = (2.0, 5.0)
+
+# Stop calling YouTube for a while once it fails repeatedly
+_youtube_breaker = CircuitBreaker(fail_max=5, reset_timeout=30)
+
+# Errors meaning YouTube could not be reached or refused to serve us, as
+# opposed to the video simply having no usable transcript
+_UPSTREAM_ERRORS = (RequestException, YouTubeRequestFailed, RequestBlocked)
+
+class UpstreamUnavailable(Exception):
+    """Raised when YouTube is failing, the circuit breaker is open or the
+    request budget is exhausted."""
+
+class _TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter applying a default timeout to requests that don't set one."""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+def _create_http_client():
+    """
+    Create the HTTP session used for all YouTube requests.
+
+    The connection pool is sized for the worker threads fetching transcripts
+    concurrently, so warm keepalive connections are reused rather than each
+    request paying for a new TCP+TLS handshake. youtube_transcript_api never
+    passes a timeout, so the adapter supplies one.
+
+    Returns:
+        requests.Session: The configured session
+    """
+    session = Session()
+    adapter = _TimeoutHTTPAdapter(pool_connections=32, pool_maxsize=64, timeout=YOUTUBE_TIMEOUT)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+# One client for the whole process so its session keeps connections to
+# YouTube alive between requests instead of reconnecting on every call
+_http_client = _create_http_client()
+_ytt_api = YouTubeTranscriptApi(http_client=_http_client)
+atexit.register(_http_client.close)
+
+# Hosts serving youtube.com/watch?v= and youtu.be/ video links
+_WATCH_HOSTS = frozenset({'youtube.com', 'www.youtube.com'})
+_SHORT_HOSTS = frozenset({'youtu.be', 'www.youtu.be'})
+
+# Patterns are compiled once at import since they run on every request
+_VIDEO_ID_RE = re.compile(r'[A-Za-z0-9_-]{11}')
+_SENT_BREAK_RE = re.compile(r'\.(?=[A-Z])')
+_SENT_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+
+def parse_youtube_url(url):
+    """
+    Validate a YouTube video URL and extract its video ID in a single pass.
+
+    Args:
+        url (str): The URL to parse
+
+    Returns:
+        str: The 11-character YouTube video ID or None if the URL is invalid
+    """
+    if not url or not isinstance(url, str):
+        return None
+
+    parsed_url = urlparse(url)
+    if parsed_url.scheme not in ('http', 'https'):
+        return None
+
+    if parsed_url.netloc in _SHORT_HOSTS:
+        # Handle youtu.be format
+        video_id = parsed_url.path[1:]
+    elif parsed_url.netloc in _WATCH_HOSTS and parsed_url.path == '/watch':
+        # Handle youtube.com format
+        video_id = parse_qs(parsed_url.query).get('v', [None])[0]
+    else:
+        return None
+
+    if video_id and _VIDEO_ID_RE.fullmatch(video_id):
+        return video_id
+
+    return None
+
 def validate_youtube_url(url):
     """
     Validate if the provided URL is a valid YouTube video URL.
-    
+
+    Deprecated: use parse_youtube_url, which also returns the video ID.
+
     Args:
         url (str): The URL to validate
-        
+
     Returns:
         bool: True if valid YouTube URL, False otherwise
     """
-    if not url:
-        return False
-    
-    # Common YouTube URL patterns
-    youtube_patterns = [
-        r'^https?://(www\.)?youtube\.com/watch\?v=[\w-]+',
-        r'^https?://(www\.)?youtu\.be/[\w-]+'
-    ]
-    
-    # Check if URL matches any YouTube pattern
-    for pattern in youtube_patterns:
-        if re.match(pattern, url):
-            return True
-    
-    return False
+    return parse_youtube_url(url) is not None
 
 def extract_video_id(url):
     """
     Extract the video ID from a YouTube URL.
-    
+
+    Deprecated: use parse_youtube_url.
+
     Args:
         url (str): The YouTube URL
-        
+
     Returns:
         str: The YouTube video ID or None if not found
     """
-    parsed_url = urlparse(url)
-    
-    # Handle youtu.be format
-    if 'youtu.be' in parsed_url.netloc:
-        return parsed_url.path.lstrip('/')
-    
-    # Handle youtube.com format
-    if 'youtube.com' in parsed_url.netloc:
-        query_params = parse_qs(parsed_url.query)
-        if 'v' in query_params:
-            return query_params['v'][0]
-    
-    return None
+    return parse_youtube_url(url)
+
+def _fetch_caption_data(url, video_id):
+    """
+    Fetch the caption segments for a video from YouTube.
+
+    Args:
+        url (str): The YouTube video URL
+        video_id (str): The YouTube video ID
 
-def extract_captions(url):
+    Returns:
+        list: A list of caption segments or None if not available
+    """
+    # Get the available transcripts. youtube-transcript-api 1.0.x has no way to
+    # fetch a transcript without listing first; repeat requests are served by
+    # the caption cache instead.
+    transcript_list = _ytt_api.list(video_id)
+
+    # Try to get English transcript first
+    try:
+        transcript = transcript_list.find_transcript(['en', 'en-US', 'en-GB'])
+    except NoTranscriptFound:
+        # If English not available, get the first available transcript
+        transcript = next(iter(transcript_list), None)
+
+    if transcript is None:
+        logger.warning("No transcript found for video: %s", url)
+        return None
+
+    # Get the transcript data
+    return transcript.fetch()
+
+def extract_captions(url, video_id=None):
     """
     Extract captions/subtitles from a YouTube video.
     
     Args:
         url (str): The YouTube video URL
+        video_id (str): The video ID if already parsed from the URL
         
     Returns:
         list: A list of caption segments or None if not available
+
+    Raises:
+        UpstreamUnavailable: If YouTube is failing, the circuit is open or
+            the request budget is exhausted
     """
     try:
-        video_id = extract_video_id(url)
+        if video_id is None:
+            video_id = parse_youtube_url(url)
         
         if not video_id:
-            logger.warning(f"Could not extract video ID from URL: {url}")
+            logger.warning("Could not extract video ID from URL: %s", url)
             return None
         
-        logger.debug(f"Extracting captions for video ID: {video_id}")
-        
-        # Get the available transcripts
-        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-        
-        # Try to get English transcript first
+        logger.debug("Extracting captions for video ID: %s", video_id)
+
+        # Fail fast while YouTube is down rather than tying up a worker on
+        # calls that will most likely time out
+        if _youtube_breaker.is_open():
+            raise UpstreamUnavailable("YouTube is currently unavailable")
+
+        # Stay within our YouTube request budget. This is checked before the
+        # breaker hands out its trial call, which would otherwise be used up
+        # without YouTube being called.
+        if not _youtube_bucket.acquire(2, timeout=YOUTUBE_BUDGET_WAIT):
+            raise UpstreamUnavailable("YouTube request budget exhausted")
+
+        if not _youtube_breaker.allow_request():
+            raise UpstreamUnavailable("YouTube is currently unavailable")
+
         try:
-            transcript = transcript_list.find_transcript(['en'])
-        except:
-            # If English not available, get the first available transcript
-            transcript = transcript_list.find_transcript(['en-US', 'en-GB'])
-            
-        # Get the transcript data
-        caption_data = transcript.fetch()
+            caption_data = _fetch_caption_data(url, video_id)
+        except _UPSTREAM_ERRORS as e:
+            _youtube_breaker.record_failure()
+            raise UpstreamUnavailable(str(e)) from e
+        except CouldNotRetrieveTranscript:
+            # YouTube answered; this video just has no usable transcript
+            _youtube_breaker.record_success()
+            raise
+
+        _youtube_breaker.record_success()
         return caption_data
-        
+
+    except UpstreamUnavailable:
+        raise
     except NoTranscriptFound:
-        logger.warning(f"No transcript found for video: {url}")
+        logger.warning("No transcript found for video: %s", url)
         return None
     except TranscriptsDisabled:
-        logger.warning(f"Transcripts are disabled for video: {url}")
+        logger.warning("Transcripts are disabled for video: %s", url)
         return None
     except VideoUnavailable:
-        logger.warning(f"Video unavailable: {url}")
+        logger.warning("Video unavailable: %s", url)
         return None
     except Exception as e:
-        logger.error(f"Error extracting captions: {str(e)}")
+        logger.error("Error extracting captions: %s", e)
         return None
 
-def format_captions(caption_data):
+_get_text_attr = attrgetter('text')
+_get_text_item = itemgetter('text')
+
+def _collapse_whitespace(text):
+    r"""
+    Collapse each run of whitespace into a single space.
+
+    Equivalent to re.sub(r'\s+', ' ', text), but str.split() finds the runs
+    in C. split() also drops leading and trailing whitespace, so a single
+    space is put back on each end that had some.
+
+    Args:
+        text (str): The text to clean
+
+    Returns:
+        str: The text with whitespace runs collapsed
     """
-    Process and format raw caption data into readable text.
-    
+    collapsed = ' '.join(text.split())
+    if not collapsed:
+        return ' ' if text else ''
+    if text[0].isspace():
+        collapsed = ' ' + collapsed
+    if text[-1].isspace():
+        collapsed += ' '
+    return collapsed
+
+def _clean_and_paragraphize(raw_text, sentences_per_para=5):
+    """
+    Regex implementation of caption_clean.clean_and_paragraphize.
+
+    Args:
+        raw_text (str): The caption segments joined with spaces
+        sentences_per_para (int): Number of sentences per paragraph
+
+    Yields:
+        str: The formatted paragraphs, without empty ones
+    """
+    # Remove redundant newlines and spaces
+    cleaned_text = _collapse_whitespace(raw_text)
+
+    # Fix sentence breaks (ensure proper spacing after periods)
+    cleaned_text = _SENT_BREAK_RE.sub('. ', cleaned_text)
+
+    # Add paragraph breaks at natural points (every ~5-7 sentences)
+    sentences = _SENT_SPLIT_RE.split(cleaned_text)
+
+    for i in range(0, len(sentences), sentences_per_para):
+        paragraph = ' '.join(sentences[i:i + sentences_per_para])
+        if paragraph:
+            yield paragraph
+
+def iter_format_captions(caption_data):
+    """
+    Process raw caption data into readable paragraphs, one at a time.
+
     Args:
         caption_data (list): List of caption segments from YouTube
-        
-    Returns:
-        str: Formatted text for readability
+
+    Yields:
+        str: Formatted paragraphs, to be separated by blank lines
     """
     if not caption_data:
-        return ""
+        return
     
-    # Extract text from each caption segment
-    # The YouTube API returns objects with attributes, not dictionaries
+    # Extract text from each caption segment and join into a single string.
+    # The YouTube API returns objects with attributes; plain dictionaries are
+    # still accepted for backwards compatibility.
     try:
-        # Try accessing as dictionary first (for backwards compatibility)
-        caption_texts = [segment['text'] for segment in caption_data]
-    except (TypeError, KeyError):
-        # If that fails, try accessing as object attributes
+        raw_text = ' '.join(map(_get_text_attr, caption_data))
+    except AttributeError:
         try:
-            caption_texts = [segment.text for segment in caption_data]
-        except AttributeError:
+            raw_text = ' '.join(map(_get_text_item, caption_data))
+        except (TypeError, KeyError):
             # If both methods fail, log the error and return empty string
-            logger.error(f"Unable to extract text from captions. Type: {type(caption_data)}")
+            logger.error("Unable to extract text from captions. Type: %s", type(caption_data))
             if caption_data:
-                logger.error(f"First item type: {type(caption_data[0])}")
-            return "Error: Unable to process captions from this video. Please try another video."
-    
-    # Join all texts into a single string
-    raw_text = ' '.join(caption_texts)
-    
-    # Clean up common formatting issues
-    cleaned_text = raw_text
-    
-    # Remove redundant newlines and spaces
-    cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
-    
-    # Fix sentence breaks (ensure proper spacing after periods)
-    cleaned_text = re.sub(r'\.(?=[A-Z])', '. ', cleaned_text)
-    
-    # Add paragraph breaks at natural points (every ~5-7 sentences)
-    sentences = re.split(r'(?<=[.!?])\s+', cleaned_text)
-    paragraphs = []
-    
-    for i in range(0, len(sentences), 5):
-        paragraph = ' '.join(sentences[i:i+5])
-        if paragraph:
-            paragraphs.append(paragraph)
-    
-    formatted_text = '\n\n'.join(paragraphs)
-    
-    return formatted_text
\ No newline at end of file
+                logger.error("First item type: %s", type(caption_data[0]))
+            yield "Error: Unable to process captions from this video. Please try another video."
+            return
+
+    if clean_and_paragraphize is not None:
+        yield from clean_and_paragraphize(raw_text)
+    else:
+        yield from _clean_and_paragraphize(raw_text)
+
+def format_captions(caption_data):
+    """
+    Process and format raw caption data into readable text.
+
+    Args:
+        caption_data (list): List of caption segments from YouTube
+
+    Returns:
+        str: Formatted text for readability
+    """
+    return '\n\n'.join(iter_format_captions(caption_data))
@@ -1,6 +1,7 @@
-# main.py - Entry point for the Flask application
+# main.py - Entry point for the FastAPI application
+import os
 import logging
 from app import app
 
-# Configure logging for easier debugging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; verbose output is only wanted during local development
+logging.basicConfig(level=logging.DEBUG if os.environ.get('APP_ENV') == 'development' else logging.INFO)
@@ -0,0 +1,205 @@
+# rate_limit.py - Rate limiting for inbound API requests and outbound YouTube calls,
+# plus a circuit breaker for when YouTube is failing
+import os
+import time
+import threading
+import logging
+from limits import parse
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def get_client_address(request):
+    """
+    Return the address to rate limit a request by.
+
+    The app runs behind a proxy (the Heroku router) that appends the address
+    it received the request from to X-Forwarded-For. Entries to the left of
+    it come from the client and can be forged, so only the rightmost one is
+    used. Requests without the header, e.g. in local development, fall back
+    to the peer address.
+
+    Args:
+        request (Request): The incoming request
+
+    Returns:
+        str: The client address
+    """
+    forwarded_for = request.headers.getlist("x-forwarded-for")
+    if forwarded_for:
+        client = forwarded_for[-1].rsplit(",", 1)[-1].strip()
+        if client:
+            return client
+    return get_remote_address(request)
+
+# Per-client limits on the API. Counters live in Redis when REDIS_URL is set so
+# every worker process shares them; otherwise each process counts on its own.
+# Clients are keyed by get_client_address rather than request.client. The
+# Heroku router has no fixed address, so uvicorn trusts every forwarding hop
+# (FORWARDED_ALLOW_IPS, see procfile) to honour X-Forwarded-Proto, and
+# request.client is then the leftmost, client-supplied entry.
+limiter = Limiter(
+    key_func=get_client_address,
+    default_limits=["100/minute"],
+    storage_uri=os.environ.get("REDIS_URL") or "memory://",
+    strategy="moving-window",
+    swallow_errors=True,
+    in_memory_fallback_enabled=True,
+)
+
+# Videos a client may request per minute, shared by the single and batch
+# caption endpoints. Each URL in a batch counts as one request, so batching
+# is no way around the limit.
+VIDEO_RATE_LIMIT = "10/minute"
+VIDEO_RATE_LIMIT_SCOPE = "videos"
+video_rate_limit = parse(VIDEO_RATE_LIMIT)
+
+def hit_video_limit(request, count):
+    """
+    Charge a number of videos against the client's shared video rate limit.
+
+    Args:
+        request (Request): The incoming request
+        count (int): Number of videos requested
+
+    Returns:
+        bool: False if the client has run over the limit, True otherwise
+    """
+    try:
+        return limiter.limiter.hit(
+            video_rate_limit, get_client_address(request), VIDEO_RATE_LIMIT_SCOPE, cost=count
+        )
+    except Exception as e:
+        # Like the limiter itself, let requests through if storage fails
+        logger.warning("Rate limit check failed: %s", e)
+        return True
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to pace calls to an upstream service.
+
+    Tokens refill continuously at `rate_per_minute` up to `capacity`. Callers
+    acquire the tokens a call is estimated to cost and wait until the bucket
+    holds enough of them, or give up if that would take longer than they are
+    willing to wait.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, estimated_tokens=1, timeout=None):
+        """
+        Take tokens from the bucket, sleeping until enough are available.
+
+        Args:
+            estimated_tokens (int): Number of tokens the upcoming call costs
+            timeout (float): Longest time to wait in seconds, or None to wait
+                as long as it takes
+
+        Returns:
+            bool: True once the tokens are taken, False if they would not be
+                available within the timeout
+        """
+        estimated_tokens = min(estimated_tokens, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= estimated_tokens:
+                    self.tokens -= estimated_tokens
+                    return True
+
+                wait = (estimated_tokens - self.tokens) / self.rate
+
+            # Give up straight away rather than sleeping for nothing
+            if deadline is not None and now + wait > deadline:
+                return False
+
+            logger.debug("Rate limit reached, waiting %.2fs for tokens", wait)
+            time.sleep(wait)
+
+def per_process_budget(total_per_minute):
+    """
+    Split a service-wide requests-per-minute budget across worker processes.
+
+    Args:
+        total_per_minute (int): Budget shared by all worker processes
+
+    Returns:
+        float: This process's share of the budget
+    """
+    workers = int(os.environ.get("WEB_CONCURRENCY") or os.cpu_count() or 1)
+    return max(total_per_minute / workers, 1)
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker for calls to an upstream service.
+
+    After `fail_max` consecutive failures the circuit opens and calls are
+    refused for `reset_timeout` seconds. After that a single trial call is let
+    through: success closes the circuit, failure keeps it open for another
+    `reset_timeout`.
+    """
+
+    def __init__(self, fail_max=5, reset_timeout=30):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        """
+        Check whether calls are currently being refused, without claiming the
+        trial call allow_request() hands out once reset_timeout has passed.
+
+        Returns:
+            bool: True while the circuit is open, False otherwise
+        """
+        with self.lock:
+            return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow_request(self):
+        """
+        Check whether a call may be made to the upstream service.
+
+        Returns:
+            bool: False while the circuit is open, True otherwise
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return True
+
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+
+            # Let one trial call through and hold off the others until it
+            # has had a full reset_timeout to complete
+            self.opened_at = now
+            return True
+
+    def record_success(self):
+        """Record a successful call, closing the circuit."""
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """Record a failed call, opening the circuit after too many in a row."""
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.fail_max:
+                if self.opened_at is None:
+                    logger.warning("Circuit opened after %s consecutive failures", self.failures)
+                self.opened_at = time.monotonic()
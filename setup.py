@@ -0,0 +1,13 @@
+# setup.py - Builds the caption_clean Cython extension
+#
+# Run at install time, before starting the app:
+#     python setup.py build_ext --inplace
+# caption_service falls back to its pure Python implementation when the
+# extension hasn't been built.
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="caption-clean",
+    ext_modules=cythonize("caption_clean.pyx", language_level=3),
+)
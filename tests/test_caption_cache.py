@@ -0,0 +1,83 @@
+# test_caption_cache.py - Tests for the Redis caption cache
+import asyncio
+import pytest
+import fakeredis.aioredis
+import caption_cache
+from caption_cache import (
+    CAPTION_TTL, HOT_CAPTION_TTL, HOT_THRESHOLD, NEGATIVE_TTL, STALE_TTL, BucketTimeRateLimit,
+    cache_key, get_cached_captions, get_stale_captions, set_cached_captions
+)
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(caption_cache, 'popularity', BucketTimeRateLimit())
+    return fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_miss_then_hit(client):
+    assert run(get_cached_captions(client, 'vid')) == (False, None)
+    run(set_cached_captions(client, 'vid', 'Hello.'))
+    assert run(get_cached_captions(client, 'vid')) == (True, 'Hello.')
+    assert run(client.ttl(cache_key('vid'))) == CAPTION_TTL + STALE_TTL
+
+def test_negative_entry(client):
+    run(set_cached_captions(client, 'vid', None))
+    assert run(get_cached_captions(client, 'vid')) == (True, None)
+    assert run(client.ttl(cache_key('vid'))) == NEGATIVE_TTL
+
+@pytest.mark.parametrize('ttl, hit', [
+    (STALE_TTL + 1, True),
+    (STALE_TTL, False),
+    (1, False),
+])
+def test_stale_window(client, ttl, hit):
+    run(client.set(cache_key('vid'), 'Hello.', ex=ttl))
+    assert run(get_cached_captions(client, 'vid')) == ((True, 'Hello.') if hit else (False, None))
+
+    # Stale captions are still available as a fallback
+    assert run(get_stale_captions(client, 'vid')) == 'Hello.'
+
+def test_no_stale_fallback_for_negative_entry(client):
+    run(set_cached_captions(client, 'vid', None))
+    assert run(get_stale_captions(client, 'vid')) is None
+
+def test_hot_video_ttl_extended_once(client, monkeypatch):
+    run(set_cached_captions(client, 'vid', 'Hello.'))
+
+    expires = []
+    expire = client.expire
+    async def counting_expire(*args, **kwargs):
+        expires.append(args)
+        return await expire(*args, **kwargs)
+    monkeypatch.setattr(client, 'expire', counting_expire)
+
+    for _ in range(HOT_THRESHOLD * 2):
+        assert run(get_cached_captions(client, 'vid')) == (True, 'Hello.')
+
+    assert len(expires) == 1
+    assert run(client.ttl(cache_key('vid'))) == HOT_CAPTION_TTL + STALE_TTL
+
+def test_hot_video_negative_entry_keeps_short_ttl(client):
+    run(set_cached_captions(client, 'vid', None))
+    for _ in range(HOT_THRESHOLD * 2):
+        run(get_cached_captions(client, 'vid'))
+    assert run(client.ttl(cache_key('vid'))) == NEGATIVE_TTL
+
+def test_caching_disabled():
+    assert run(get_cached_captions(None, 'vid')) == (False, None)
+    assert run(get_stale_captions(None, 'vid')) is None
+    run(set_cached_captions(None, 'vid', 'Hello.'))
+
+def test_popularity_window():
+    counter = BucketTimeRateLimit(buckets=2, threshold=2)
+    for _ in range(3):
+        counter.hit('vid')
+    assert counter.is_hot('vid')
+
+    counter.rotate()
+    assert counter.count('vid') == 3
+    counter.rotate()
+    assert counter.count('vid') == 0
+    assert not counter.is_hot('vid')
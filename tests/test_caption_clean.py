@@ -0,0 +1,47 @@
+# test_caption_clean.py - Equivalence checks for the caption cleanup implementations
+import re
+import random
+import pytest
+from caption_service import _clean_and_paragraphize
+
+# Characters the cleanup treats specially, plus ordinary text. The whitespace
+# covers what str.split() and the regex \s both recognise beyond plain spaces.
+_ALPHABET = [
+    'a', 'B', 'x', 'Y', ',', '.', '!', '?', '.A', '\u00e9',
+    ' ', '  ', '\n', '\t', '\r', '\x1c', '\x1f', '\x85', '\u00a0', '\u2003', '\u3000',
+]
+
+def _reference(raw_text, sentences_per_para):
+    """The original regex pipeline the faster implementations must match."""
+    cleaned_text = re.sub(r'\s+', ' ', raw_text)
+    cleaned_text = re.sub(r'\.(?=[A-Z])', '. ', cleaned_text)
+    sentences = re.split(r'(?<=[.!?])\s+', cleaned_text)
+    paragraphs = []
+    for i in range(0, len(sentences), sentences_per_para):
+        paragraph = ' '.join(sentences[i:i + sentences_per_para])
+        if paragraph:
+            paragraphs.append(paragraph)
+    return paragraphs
+
+def _random_texts(seed, count=5000):
+    """Generate random caption text the way segments are joined for cleanup."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        segments = [
+            ''.join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 8)))
+            for _ in range(rng.randint(0, 12))
+        ]
+        yield ' '.join(segments)
+
+@pytest.mark.parametrize('sentences_per_para', [1, 2, 5])
+def test_regex_matches_reference(sentences_per_para):
+    for raw_text in _random_texts(sentences_per_para):
+        assert list(_clean_and_paragraphize(raw_text, sentences_per_para)) == \
+            _reference(raw_text, sentences_per_para), repr(raw_text)
+
+@pytest.mark.parametrize('sentences_per_para', [1, 2, 5])
+def test_cython_matches_regex(sentences_per_para):
+    caption_clean = pytest.importorskip('caption_clean')
+    for raw_text in _random_texts(sentences_per_para):
+        assert caption_clean.clean_and_paragraphize(raw_text, sentences_per_para) == \
+            list(_clean_and_paragraphize(raw_text, sentences_per_para)), repr(raw_text)
@@ -0,0 +1,64 @@
+# test_caption_service.py - Tests for YouTube caption extraction
+import pytest
+import caption_service
+from caption_service import UpstreamUnavailable, extract_captions
+from rate_limit import CircuitBreaker, TokenBucket
+
+class FakeTranscriptApi:
+    """Transcript API whose list() raises the given error, or succeeds."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def list(self, video_id):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return FakeTranscriptList()
+
+class FakeTranscriptList:
+    def find_transcript(self, languages):
+        return FakeTranscript()
+
+class FakeTranscript:
+    def fetch(self):
+        return [{'text': 'Hello.'}]
+
+@pytest.fixture
+def youtube(monkeypatch):
+    api = FakeTranscriptApi()
+    monkeypatch.setattr(caption_service, '_ytt_api', api)
+    monkeypatch.setattr(caption_service, '_youtube_bucket', TokenBucket(600))
+    monkeypatch.setattr(caption_service, '_youtube_breaker', CircuitBreaker(fail_max=1, reset_timeout=30))
+    monkeypatch.setattr(caption_service, 'YOUTUBE_BUDGET_WAIT', 0)
+    return api
+
+def test_extract_captions(youtube):
+    assert extract_captions('https://youtu.be/dQw4w9WgXcQ') == [{'text': 'Hello.'}]
+
+def test_upstream_error_opens_circuit(youtube):
+    youtube.error = caption_service.RequestException('timed out')
+    with pytest.raises(UpstreamUnavailable):
+        extract_captions('https://youtu.be/dQw4w9WgXcQ')
+
+    youtube.error = None
+    with pytest.raises(UpstreamUnavailable):
+        extract_captions('https://youtu.be/dQw4w9WgXcQ')
+    assert youtube.calls == 1
+
+def test_exhausted_budget_does_not_use_up_trial_call(youtube, monkeypatch):
+    breaker = caption_service._youtube_breaker
+    breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+
+    bucket = caption_service._youtube_bucket
+    bucket.tokens = 0
+    with pytest.raises(UpstreamUnavailable):
+        extract_captions('https://youtu.be/dQw4w9WgXcQ')
+    assert youtube.calls == 0
+
+    # Once budget is back the trial call goes through and closes the circuit
+    bucket.tokens = bucket.capacity
+    assert extract_captions('https://youtu.be/dQw4w9WgXcQ') == [{'text': 'Hello.'}]
+    assert not breaker.is_open()
@@ -0,0 +1,110 @@
+# test_rate_limit.py - Tests for the token bucket and circuit breaker
+import pytest
+import rate_limit
+from rate_limit import CircuitBreaker, TokenBucket
+
+class FakeClock:
+    """Stand-in for the time module that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    return clock
+
+def test_bucket_starts_full(clock):
+    bucket = TokenBucket(60)
+    assert all(bucket.acquire(2) for _ in range(30))
+    assert clock.slept == []
+
+def test_bucket_waits_for_refill(clock):
+    bucket = TokenBucket(60, capacity=2)
+    assert bucket.acquire(2)
+    assert bucket.acquire(1)
+    assert clock.slept == [pytest.approx(1.0)]
+
+def test_bucket_gives_up_without_sleeping_past_timeout(clock):
+    bucket = TokenBucket(6, capacity=2)  # one token every 10 seconds
+    assert bucket.acquire(2)
+    assert not bucket.acquire(1, timeout=5)
+    assert clock.slept == []
+
+    # Nothing was taken by the refused call
+    clock.now += 10
+    assert bucket.acquire(1, timeout=0)
+
+def test_bucket_waits_within_timeout(clock):
+    bucket = TokenBucket(6, capacity=2)
+    assert bucket.acquire(2)
+    assert bucket.acquire(1, timeout=10)
+    assert clock.slept == [pytest.approx(10.0)]
+
+def test_bucket_caps_cost_at_capacity(clock):
+    bucket = TokenBucket(60, capacity=2)
+    assert bucket.acquire(5, timeout=0)
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(fail_max=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.is_open()
+    assert not breaker.allow_request()
+
+def test_breaker_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(fail_max=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open()
+
+def test_breaker_lets_one_trial_through_after_timeout(clock):
+    breaker = CircuitBreaker(fail_max=1, reset_timeout=30)
+    breaker.record_failure()
+
+    clock.now += 30
+    assert not breaker.is_open()
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    # A successful trial closes the circuit
+    breaker.record_success()
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+
+def test_breaker_failed_trial_keeps_circuit_open(clock):
+    breaker = CircuitBreaker(fail_max=1, reset_timeout=30)
+    breaker.record_failure()
+
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_failure()
+
+    clock.now += 29
+    assert not breaker.allow_request()
+    clock.now += 1
+    assert breaker.allow_request()
+
+def test_is_open_does_not_claim_the_trial(clock):
+    breaker = CircuitBreaker(fail_max=1, reset_timeout=30)
+    breaker.record_failure()
+
+    clock.now += 30
+    assert not breaker.is_open()
+    assert not breaker.is_open()
+    assert breaker.allow_request()